@@ -0,0 +1,38 @@
+import argparse
+import itertools
+
+from main import AI_DEPTH, Board
+from record import read_games
+
+
+def format_pv(pv):
+    return ' '.join('%d,%d-%d,%d' % move for move in pv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the best lines for a position as the search deepens')
+    parser.add_argument('log', nargs='?', help='game record log; the start position is used without one')
+    parser.add_argument('--game', type=int, default=0, help='index of the game in the log')
+    parser.add_argument('--ply', type=int, help='moves into the game (default: the final position)')
+    parser.add_argument('--lines', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=AI_DEPTH + 1)
+    parser.add_argument('--time', type=float, help='stop after this many seconds')
+    args = parser.parse_args()
+
+    board = Board()
+    if args.log:
+        record = next(itertools.islice(read_games(args.log), args.game, None), None)
+        if record is None:
+            parser.error(f'{args.log} has no game {args.game}')
+        board = record.position_at(len(record) if args.ply is None else args.ply)
+
+    side = 'Red' if board.current_turn == 'r' else 'Black'
+    print(f'{side} to move')
+    for depth, lines in board.analyse(args.lines, args.depth, args.time):
+        print(f'depth {depth}  nodes {board.nodes}')
+        for score, pv in lines:
+            print(f'  {score:>7}  {format_pv(pv)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import random
+
+from main import Board, SEARCH_FEATURES
+
+# Moves from the start position to the middlegame position
+OPENING_MOVES = [
+    ((7, 7), (4, 7)),  # Red central cannon
+    ((7, 0), (6, 2)),  # Black horse
+    ((7, 9), (6, 7)),  # Red horse
+    ((8, 0), (7, 0)),  # Black chariot
+    ((8, 9), (7, 9)),  # Red chariot
+    ((1, 0), (2, 2)),  # Black horse
+]
+
+# Fixed positions: name -> (pieces, side to move, expected best move), or None for the two
+# positions reached from the start, which have no single best move and only give node counts.
+# Each expected move is a tactic that a depth 1 search misses.
+POSITIONS = {
+    'opening': None,
+    'middlegame': None,
+    'chariot_mate': (
+        (('general', 'r', 5, 9), ('chariot', 'r', 0, 1), ('chariot', 'r', 8, 5),
+         ('general', 'b', 4, 0), ('soldier', 'b', 2, 6)),
+        'r', (8, 5, 8, 0),
+    ),
+    'chariot_skewer': (
+        (('general', 'r', 3, 9), ('chariot', 'r', 0, 4), ('soldier', 'r', 8, 4),
+         ('general', 'b', 4, 2), ('chariot', 'b', 4, 0), ('soldier', 'b', 0, 6)),
+        'r', (0, 4, 4, 4),
+    ),
+    # Check down the file, then take the chariot behind the general's old square
+    'check_skewer': (
+        (('general', 'r', 3, 7), ('chariot', 'r', 2, 0), ('cannon', 'r', 7, 9), ('cannon', 'r', 2, 4),
+         ('general', 'b', 4, 2), ('chariot', 'b', 4, 6), ('cannon', 'b', 6, 2), ('soldier', 'b', 0, 6)),
+        'r', (2, 0, 4, 0),
+    ),
+    # Check first, so the cannon's capture of the chariot cannot be answered
+    'check_tempo': (
+        (('general', 'r', 4, 7), ('chariot', 'r', 3, 5), ('cannon', 'r', 0, 8), ('cannon', 'r', 4, 6),
+         ('general', 'b', 4, 2), ('chariot', 'b', 7, 8), ('cannon', 'b', 4, 8), ('advisor', 'b', 4, 1)),
+        'r', (3, 5, 4, 5),
+    ),
+    # Chariot attacks a cannon and a soldier on the same file
+    'chariot_fork': (
+        (('general', 'r', 5, 7), ('cannon', 'r', 3, 8), ('cannon', 'r', 5, 6), ('chariot', 'r', 8, 3),
+         ('general', 'b', 5, 0), ('soldier', 'b', 0, 8), ('cannon', 'b', 0, 1), ('advisor', 'b', 3, 2)),
+        'r', (8, 3, 0, 3),
+    ),
+}
+
+# Each technique alone, none at all and all together
+CONFIGS = {'none': {name: False for name in SEARCH_FEATURES}}
+for feature in SEARCH_FEATURES:
+    CONFIGS[feature] = {name: name == feature for name in SEARCH_FEATURES}
+CONFIGS['all'] = {name: True for name in SEARCH_FEATURES}
+
+
+def setup(name):
+    board = Board()
+    if name == 'middlegame':
+        for (from_x, from_y), (to_x, to_y) in OPENING_MOVES:
+            board.move_piece(board.get_piece_at(from_x, from_y), to_x, to_y)
+    elif POSITIONS[name]:
+        pieces, current_turn, _ = POSITIONS[name]
+        board.setup(pieces, current_turn)
+    return board
+
+
+def format_move(move):
+    return '%d,%d-%d,%d' % move if move else '-'
+
+
+def run(name, features, depth, budget, seed):
+    expected = POSITIONS[name][2] if POSITIONS[name] else None
+
+    # Fixed depth: node count, time and the first iteration that found the expected move
+    random.seed(seed)
+    board = setup(name)
+    board.search(max_depth=depth, time_limit=None, features=features)
+    _, _, move, nodes, seconds = board.iterations[-1]
+    solve_time = None
+    if expected:
+        solve_time = next((t for _, _, m, _, t in board.iterations if m == expected), None)
+
+    # Fixed time: how deep the search gets within the budget
+    random.seed(seed)
+    board = setup(name)
+    board.search(max_depth=64, time_limit=budget, features=features)
+    reached = board.iterations[-1][0] if board.iterations else 0
+
+    return nodes, seconds, move, solve_time, reached
+
+
+def run_multipv(name, lines, depth, seed):
+    # Nodes for analyse with one line and with `lines` lines at the same depth
+    nodes = []
+    for count in (1, lines):
+        random.seed(seed)
+        board = setup(name)
+        for _ in board.analyse(count, depth):
+            pass
+        nodes.append(board.nodes)
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Node counts and solve times for each selective search technique')
+    parser.add_argument('--depth', type=int, default=4, help='fixed search depth')
+    parser.add_argument('--budget', type=float, default=3.0, help='seconds for the fixed-time search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lines', type=int, default=3, help='lines for the multi-PV comparison')
+    parser.add_argument('--positions', nargs='+', choices=POSITIONS, default=list(POSITIONS))
+    parser.add_argument('--configs', nargs='+', choices=CONFIGS, default=list(CONFIGS))
+    args = parser.parse_args()
+
+    print(f'{"position":<16}{"config":<22}{"nodes":>9}{"time":>9}  {"move":<10}'
+          f'{"solved":>8}{"depth in " + str(args.budget) + "s":>16}')
+    for name in args.positions:
+        for config in args.configs:
+            nodes, seconds, move, solve_time, reached = run(
+                name, CONFIGS[config], args.depth, args.budget, args.seed)
+            solved = '-' if solve_time is None else f'{solve_time:.2f}s'
+            print(f'{name:<16}{config:<22}{nodes:>9}{seconds:>8.2f}s  {format_move(move):<10}'
+                  f'{solved:>8}{reached:>16}')
+
+    print()
+    print(f'{"position":<16}{"1 line":>9}{str(args.lines) + " lines":>10}{"ratio":>8}')
+    for name in args.positions:
+        single, multi = run_multipv(name, args.lines, args.depth, args.seed)
+        print(f'{name:<16}{single:>9}{multi:>10}{multi / single:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs in a fresh interpreter so nothing is cached from an earlier run
+CHILD = '''
+import json, sys, time
+marks = {}
+start = time.perf_counter()
+if sys.argv[1] == 'full-init':
+    import pygame
+    pygame.init()
+    marks['pygame.init'] = time.perf_counter() - start
+import main
+marks['import'] = time.perf_counter() - start
+screen = main.init_display()
+marks['display'] = time.perf_counter() - start
+game = main.Game()
+game.draw(screen)
+main.pygame.display.flip()
+marks['first frame'] = time.perf_counter() - start
+game.show_menu = False
+game.draw(screen)
+main.pygame.display.flip()
+marks['board frame'] = time.perf_counter() - start
+game.draw(screen)
+main.pygame.display.flip()
+marks['next frame'] = time.perf_counter() - start
+print(json.dumps(marks))
+'''
+
+
+def run_once(mode, env):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, mode], env=env, check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    total = time.perf_counter() - start
+    marks = json.loads(output.strip().splitlines()[-1])
+    marks['process total'] = total
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time to first frame of main.py in fresh processes')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--headless', action='store_true', help='use the SDL dummy video driver')
+    parser.add_argument('--full-init', action='store_true',
+                        help='also call pygame.init() first, for comparison with the old startup')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    if args.headless:
+        env['SDL_VIDEODRIVER'] = 'dummy'
+        env['SDL_AUDIODRIVER'] = 'dummy'
+
+    modes = ['lazy'] + (['full-init'] if args.full_init else [])
+    for mode in modes:
+        runs = [run_once(mode, env) for _ in range(args.runs)]
+        print(f'{mode} startup, median seconds over {args.runs} runs (process total includes interpreter start):')
+        for mark in runs[0]:
+            print(f'  {mark:<14}{statistics.median(r[mark] for r in runs):>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import Board
+from server import DEFAULT_HOST, DEFAULT_PORT, raise_fd_limit
+
+
+class Player:
+    # One simulated player: plays random legal moves as red and mirrors the game locally
+    def __init__(self, reader, writer, rng):
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.board = Board()
+
+    async def request(self, message):
+        self.writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError('server closed the connection')
+        return json.loads(line)
+
+    def pick_move(self):
+        # A random legal move of a random piece; only generates moves until a piece has one,
+        # which keeps the client's share of the event loop small
+        pieces = [p for p in self.board.pieces if p.color == self.board.current_turn]
+        self.rng.shuffle(pieces)
+        for piece in pieces:
+            moves = self.board.get_legal_moves(piece)
+            if moves:
+                x, y = self.rng.choice(moves)
+                return (piece.x, piece.y), (x, y)
+        return None
+
+    def apply(self, move):
+        (from_x, from_y), (to_x, to_y) = move
+        self.board.move_piece(self.board.get_piece_at(from_x, from_y), to_x, to_y)
+
+    async def play(self, moves, latencies):
+        response = await self.request({'op': 'new', 'color': 'r'})
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        game_id = response['game']
+
+        for _ in range(moves):
+            move = self.pick_move()
+            if move is None:
+                break
+
+            start = time.perf_counter()
+            response = await self.request({'op': 'move', 'game': game_id,
+                                           'from': move[0], 'to': move[1]})
+            latencies.append(time.perf_counter() - start)
+            if not response['ok']:
+                raise RuntimeError(response['error'])
+
+            self.apply(move)
+            if response['reply']:
+                self.apply(response['reply'])
+            if response['result']:
+                break
+
+
+async def run_player(args, index, latencies, errors):
+    rng = random.Random(args.seed + index)
+    # Spread connection attempts so the server's accept backlog isn't flooded
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    try:
+        if args.unix:
+            reader, writer = await asyncio.open_unix_connection(args.unix)
+        else:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+    except OSError as e:
+        errors.append(e)
+        return
+
+    try:
+        await Player(reader, writer, rng).play(args.moves, latencies)
+    except (OSError, RuntimeError, ValueError) as e:
+        errors.append(e)
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+async def run_players(args, indices, latencies, errors):
+    await asyncio.gather(*(run_player(args, i, latencies, errors) for i in indices))
+
+
+def run_process(args, indices):
+    # Runs in a client process: its players share one event loop, other processes take the rest
+    raise_fd_limit()
+    latencies = []
+    errors = []
+    asyncio.run(run_players(args, indices, latencies, errors))
+    return latencies, [repr(e) for e in errors], time.process_time()
+
+
+def run(args):
+    processes = min(args.processes, args.players)
+    latencies = []
+    errors = []
+    client_cpu = 0.0
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        shares = [range(i, args.players, processes) for i in range(processes)]
+        for share_latencies, share_errors, cpu in pool.map(run_process, [args] * processes, shares):
+            latencies += share_latencies
+            errors += share_errors
+            client_cpu += cpu
+    elapsed = time.perf_counter() - start
+
+    print(f'players: {args.players}  moves: {len(latencies)}  errors: {len(errors)}  '
+          f'time: {elapsed:.1f}s  throughput: {len(latencies) / elapsed:.1f} moves/s')
+    # Client CPU time spent in the load generator itself, which competes with the server
+    print(f'client processes: {processes}  client cpu: {client_cpu:.1f}s  '
+          f'per move: {client_cpu / max(len(latencies), 1) * 1000:.1f} ms')
+    if errors:
+        print(f'first error: {errors[0]}')
+    if latencies:
+        latencies.sort()
+        print(f'move latency  p50: {percentile(latencies, 0.50) * 1000:.1f} ms  '
+              f'p99: {percentile(latencies, 0.99) * 1000:.1f} ms  '
+              f'mean: {statistics.fmean(latencies) * 1000:.1f} ms  '
+              f'max: {latencies[-1] * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many players against server.py and report move latency')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='connect to a Unix socket path instead of TCP')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--moves', type=int, default=5, help='moves each player makes')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which players connect')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='client processes the players are spread across')
+    args = parser.parse_args()
+
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
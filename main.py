@@ -1,10 +1,11 @@
-import pygame
+import os
 import sys
 import random
-from pygame.locals import *
+import threading
+import time
 
-# Initialize pygame
-pygame.init()
+# pygame is imported by init_display, so the engine can be used without it (server, workers, tools)
+pygame = None
 
 # Constants
 SCREEN_WIDTH = 800
@@ -15,6 +16,10 @@ CELL_SIZE = 60
 BOARD_MARGIN_X = (SCREEN_WIDTH - (BOARD_WIDTH - 1) * CELL_SIZE) // 2
 BOARD_MARGIN_Y = (SCREEN_HEIGHT - (BOARD_HEIGHT - 1) * CELL_SIZE) // 2
 
+# Font file used instead of scanning the system fonts for Arial, if it exists
+FONT_FILE = os.environ.get(
+    'XIANGQI_FONT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'font.ttf'))
+
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -26,10 +31,6 @@ BLUE = (0, 0, 255)
 YELLOW = (255, 255, 0)
 GRAY = (128, 128, 128)
 
-# Set up the screen
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption('Chinese Chess (Xiangqi)')
-
 # Piece values for AI evaluation
 PIECE_VALUES = {
     'r_general': 1000,
@@ -48,14 +49,57 @@ PIECE_VALUES = {
     'b_soldier': 10
 }
 
+# Draw adjudication
+REPETITION_LIMIT = 3  # Same position this many times ends the game
+MAX_QUIET_PLIES = 120  # Plies without a capture before the game is drawn
+
+# Small-int piece codes for the flat board encoding; 0 is an empty square
+PIECE_CODES = {piece_id: code for code, piece_id in enumerate(PIECE_VALUES, 1)}
+CODE_PIECES = [None] + [tuple(reversed(piece_id.split('_'))) for piece_id in PIECE_VALUES]
+PIECE_IDS = {tuple(reversed(piece_id.split('_'))): piece_id for piece_id in PIECE_VALUES}
+
+# Zobrist keys for position hashing, seeded so every process hashes alike
+_zobrist_random = random.Random(20240601)
+ZOBRIST_KEYS = {
+    piece_id: [_zobrist_random.getrandbits(64) for _ in range(BOARD_WIDTH * BOARD_HEIGHT)]
+    for piece_id in PIECE_VALUES
+}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+# AI search settings
+AI_DEPTH = 4  # Deepest iteration of the search
+AI_TIME_LIMIT = 5.0  # Seconds per AI move; unfinished iterations are discarded
+PONDER = True  # Search the player's expected reply while they think
+MATE_SCORE = 100000  # Score for capturing the general, larger than any material total
+TT_MAX_ENTRIES = 500000
+
+# Selective search techniques, each of which can be switched off per search
+SEARCH_FEATURES = {
+    'null_move': True,  # Skip a turn at reduced depth; if that still fails high, prune
+    'late_move_reductions': True,  # Search quiet moves late in the ordering less deeply
+    'check_extensions': True,  # Search one ply deeper when the side to move is in check
+    'aspiration_windows': True,  # Start each iteration with a narrow window around the last score
+}
+NULL_MOVE_REDUCTION = 2
+LMR_MIN_MOVES = 4  # Moves searched at full depth before reductions start
+ASPIRATION_WINDOW = 30
+
+# Transposition table bound types
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+
 class Piece:
+    __slots__ = ('piece_type', 'color', 'x', 'y', 'selected', 'id')
+    
     def __init__(self, piece_type, color, x, y):
         self.piece_type = piece_type
         self.color = color  # 'r' for red, 'b' for black
         self.x = x
         self.y = y
         self.selected = False
-        self.id = f"{color}_{piece_type}"
+        # Shared string from PIECE_VALUES rather than a new one per piece
+        self.id = PIECE_IDS[piece_type, color]
     
     def draw(self, surface):
         # Calculate position
@@ -67,7 +111,7 @@ class Piece:
         pygame.draw.circle(surface, WHITE, (pos_x, pos_y), CELL_SIZE // 2 - 8)
         
         # Draw piece text
-        font = pygame.font.SysFont('Arial', 20, bold=True)
+        font = get_font(20, bold=True)
         text_color = RED if self.color == 'r' else BLACK
         
         # Map piece type to display text
@@ -91,16 +135,24 @@ class Piece:
 
 class Board:
     def __init__(self):
+        # Transposition table: position hash -> (depth, score, bound, best move)
+        self.tt = {}
+        self.ponder = None
         self.reset()
     
     def reset(self):
+        self.stop_pondering()
+        self.predicted_reply = None
         self.pieces = []
+        # Moves played so far, two bytes each: from-square and to-square as y * BOARD_WIDTH + x
+        self.played_moves = bytearray()
         self.selected_piece = None
         self.player_color = 'r'  # Default player is red
         self.current_turn = 'r'  # Red goes first
         
         # Initialize pieces
         self.initialize_pieces()
+        self.clear_history()
     
     def initialize_pieces(self):
         # Red pieces (bottom)
@@ -206,7 +258,7 @@ class Board:
                         (BOARD_MARGIN_X + 3 * CELL_SIZE, BOARD_MARGIN_Y + 9 * CELL_SIZE))
         
         # Draw river text
-        font = pygame.font.SysFont('Arial', 30)
+        font = get_font(30)
         text = font.render("River", True, BLUE)
         text_rect = text.get_rect(center=(SCREEN_WIDTH // 2, BOARD_MARGIN_Y + 4.5 * CELL_SIZE))
         surface.blit(text, text_rect)
@@ -235,7 +287,7 @@ class Board:
         # Draw turn indicator
         turn_text = "Red's Turn" if self.current_turn == 'r' else "Black's Turn"
         turn_color = RED if self.current_turn == 'r' else BLACK
-        font = pygame.font.SysFont('Arial', 24)
+        font = get_font(24)
         text = font.render(turn_text, True, turn_color)
         surface.blit(text, (20, 20))
     
@@ -543,16 +595,117 @@ class Board:
         return False  # No move was made
 
     def move_piece(self, piece, x, y):
+        # Check and encode the move first, so bad coordinates raise before the board is touched
+        if not (0 <= x < BOARD_WIDTH and 0 <= y < BOARD_HEIGHT):
+            raise ValueError(f'({x}, {y}) is off the board')
+        encoded = bytes((piece.y * BOARD_WIDTH + piece.x, y * BOARD_WIDTH + x))
+
         # Check if there's a piece at the target position
         target_piece = self.get_piece_at(x, y)
         if target_piece:
             self.pieces.remove(target_piece)
 
         # Move the piece
+        self.played_moves += encoded
         piece.x, piece.y = x, y
 
         # Switch turns
         self.current_turn = 'b' if self.current_turn == 'r' else 'r'
+
+        # A capture makes every earlier position unreachable, so history restarts there
+        if target_piece:
+            self.clear_history()
+        else:
+            self.record_position(piece)
+    
+    def take_back(self, plies):
+        # Replay the game without its last `plies` moves
+        moves = self.played_moves[:len(self.played_moves) - 2 * plies]
+        player_color = self.player_color
+        self.reset()
+        self.player_color = player_color
+        for i in range(0, len(moves), 2):
+            from_square, to_square = moves[i], moves[i + 1]
+            piece = self.get_piece_at(from_square % BOARD_WIDTH, from_square // BOARD_WIDTH)
+            self.move_piece(piece, to_square % BOARD_WIDTH, to_square // BOARD_WIDTH)
+    
+    def position_hash(self):
+        h = ZOBRIST_BLACK_TO_MOVE if self.current_turn == 'b' else 0
+        for piece in self.pieces:
+            h ^= ZOBRIST_KEYS[piece.id][piece.y * BOARD_WIDTH + piece.x]
+        return h
+    
+    def clear_history(self):
+        # Each entry is (hash, mover, gave_check, chased) for a position since the last capture
+        h = self.position_hash()
+        self.history = [(h, None, False, False)]
+        self.position_counts = {h: 1}
+    
+    def record_position(self, piece):
+        h = self.position_hash()
+        gave_check = self.is_in_check(self.current_turn)
+        chased = not gave_check and self.is_chasing(piece)
+        self.history.append((h, piece.color, gave_check, chased))
+        self.position_counts[h] = self.position_counts.get(h, 0) + 1
+    
+    def is_chasing(self, piece):
+        # The moved piece chases if it now attacks an enemy piece (other than the general)
+        # that is unprotected or worth more than itself. The general and soldiers that have
+        # not crossed the river are allowed to attack repeatedly.
+        if piece.piece_type == 'general':
+            return False
+        if piece.piece_type == 'soldier' and (piece.y < 5) != (piece.color == 'r'):
+            return False
+        for x, y in self.get_legal_moves(piece, check_check=False):
+            target_piece = self.get_piece_at(x, y)
+            if not target_piece or target_piece.piece_type == 'general':
+                continue
+            if PIECE_VALUES[target_piece.id] > PIECE_VALUES[piece.id]:
+                return True
+            if not self.is_protected(target_piece, piece):
+                return True
+        return False
+    
+    def is_protected(self, target_piece, attacker):
+        # Play the capture and see whether any of the target's side could take back
+        orig_x, orig_y = attacker.x, attacker.y
+        self.pieces.remove(target_piece)
+        attacker.x, attacker.y = target_piece.x, target_piece.y
+        
+        defenders = [p for p in self.pieces if p.color == target_piece.color]
+        protected = any(
+            (target_piece.x, target_piece.y) in self.get_legal_moves(p, check_check=False)
+            for p in defenders
+        )
+        
+        attacker.x, attacker.y = orig_x, orig_y
+        self.pieces.append(target_piece)
+        return protected
+    
+    def has_legal_moves(self, color):
+        own_pieces = [p for p in self.pieces if p.color == color]
+        return any(self.get_legal_moves(p) for p in own_pieces)
+    
+    def adjudicate_repetition(self):
+        h = self.history[-1][0]
+        if self.position_counts[h] < REPETITION_LIMIT:
+            return None
+        
+        # Moves played since the repeated position first appeared
+        start = next(i for i, entry in enumerate(self.history) if entry[0] == h)
+        cycle = self.history[start + 1:]
+        
+        # Perpetual check loses; otherwise perpetual chase loses; otherwise it's a draw
+        for flag in (2, 3):
+            offenders = [
+                color for color in ('r', 'b')
+                if all(entry[flag] for entry in cycle if entry[1] == color)
+            ]
+            if len(offenders) == 1:
+                return 'b' if offenders[0] == 'r' else 'r'
+            if offenders:
+                return 'draw'
+        return 'draw'
     
     def is_game_over(self):
         # Check if any player's general is captured
@@ -571,114 +724,520 @@ class Board:
         if not black_general_exists:
             return 'r'  # Red wins
         
-        # Game continues if both generals exist
+        # A side with no legal moves loses, whether checkmated or stalemated
+        if not self.has_legal_moves(self.current_turn):
+            return 'b' if self.current_turn == 'r' else 'r'
+        
+        result = self.adjudicate_repetition()
+        if result:
+            return result
+        
+        if len(self.history) > MAX_QUIET_PLIES:
+            return 'draw'
+        
+        # Game continues
         return None
     
     def evaluate_board(self):
-        # Simple evaluation function for AI
+        # Static evaluation from red's point of view, cheap enough to call at every search leaf
         score = 0
         
-        # Material value
+        # Material value, plus a bonus for soldiers that have crossed the river
         for piece in self.pieces:
-            value = PIECE_VALUES[f"{piece.color}_{piece.piece_type}"]
+            value = PIECE_VALUES[piece.id]
+            if piece.piece_type == 'soldier' and (piece.y < 5) == (piece.color == 'r'):
+                value += 10
             if piece.color == 'b':
                 score -= value
             else:
                 score += value
         
-        # Mobility (number of legal moves)
-        red_mobility = 0
-        black_mobility = 0
-        
+        return score
+    
+    def to_bytes(self):
+        # Flat encoding: one piece code per square (y * BOARD_WIDTH + x), then the side to move
+        data = bytearray(BOARD_WIDTH * BOARD_HEIGHT + 1)
         for piece in self.pieces:
-            legal_moves = self.get_legal_moves(piece)
-            if piece.color == 'r':
-                red_mobility += len(legal_moves)
+            data[piece.y * BOARD_WIDTH + piece.x] = PIECE_CODES[piece.id]
+        data[-1] = 1 if self.current_turn == 'b' else 0
+        return bytes(data)
+    
+    def load_bytes(self, data):
+        # Position from to_bytes; history is left to the caller
+        self.pieces = [
+            Piece(*CODE_PIECES[code], square % BOARD_WIDTH, square // BOARD_WIDTH)
+            for square, code in enumerate(data[:-1]) if code
+        ]
+        self.selected_piece = None
+        self.current_turn = 'b' if data[-1] else 'r'
+    
+    def setup(self, pieces, current_turn):
+        # Arbitrary position from (piece_type, color, x, y) tuples, with a fresh history
+        self.pieces = [Piece(piece_type, color, x, y) for piece_type, color, x, y in pieces]
+        self.selected_piece = None
+        self.current_turn = current_turn
+        self.played_moves = bytearray()
+        self.clear_history()
+    
+    def get_state(self):
+        # Compact snapshot of the position and its repetition history
+        return self.to_bytes(), tuple(self.history)
+
+    def set_state(self, state):
+        data, history = state
+        self.load_bytes(data)
+        self.history = list(history)
+        self.position_counts = {}
+        for entry in self.history:
+            self.position_counts[entry[0]] = self.position_counts.get(entry[0], 0) + 1
+
+    def clone(self):
+        # Independent copy for another thread, process or snapshot; the transposition table is shared
+        board = Board.__new__(Board)
+        board.tt = self.tt
+        board.ponder = None
+        board.predicted_reply = None
+        board.player_color = self.player_color
+        board.played_moves = bytearray(self.played_moves)
+        board.load_bytes(self.to_bytes())
+        board.history = list(self.history)
+        board.position_counts = dict(self.position_counts)
+        return board
+    
+    def __getstate__(self):
+        # Pickled as the flat encoding; the transposition table and any ponder search stay behind
+        return self.to_bytes(), self.player_color, tuple(self.history), bytes(self.played_moves)
+    
+    def __setstate__(self, state):
+        data, player_color, history, played_moves = state
+        self.tt = {}
+        self.ponder = None
+        self.predicted_reply = None
+        self.player_color = player_color
+        self.played_moves = bytearray(played_moves)
+        self.set_state((data, history))
+
+    def generate_moves(self, color):
+        # Pseudo-legal moves as (piece, x, y, captured piece); the search treats
+        # capturing the general as a win instead of filtering out self-check
+        occupied = {(p.x, p.y): p for p in self.pieces}
+        moves = []
+        for piece in self.pieces:
+            if piece.color == color:
+                for x, y in self.get_legal_moves(piece, check_check=False):
+                    moves.append((piece, x, y, occupied.get((x, y))))
+        return moves
+    
+    def order_moves(self, moves, tt_move):
+        # Transposition table move first, then captures by most valuable victim, least valuable attacker
+        def key(move):
+            piece, x, y, target_piece = move
+            if tt_move == (piece.x, piece.y, x, y):
+                return -MATE_SCORE
+            if target_piece:
+                return PIECE_VALUES[piece.id] - 10 * PIECE_VALUES[target_piece.id]
+            return 0
+        moves.sort(key=key)
+        return moves
+    
+    def make_move(self, piece, x, y, target_piece):
+        # Search-only move: no history is recorded, undone by unmake_move
+        if target_piece:
+            self.pieces.remove(target_piece)
+        orig_x, orig_y = piece.x, piece.y
+        piece.x, piece.y = x, y
+        self.current_turn = 'b' if self.current_turn == 'r' else 'r'
+        return orig_x, orig_y
+    
+    def unmake_move(self, piece, orig_x, orig_y, target_piece):
+        piece.x, piece.y = orig_x, orig_y
+        if target_piece:
+            self.pieces.append(target_piece)
+        self.current_turn = 'b' if self.current_turn == 'r' else 'r'
+    
+    def search_expired(self):
+        if self.stop_event and self.stop_event.is_set():
+            return True
+        return self.search_deadline is not None and time.perf_counter() > self.search_deadline
+    
+    def store_tt(self, h, depth, score, bound, move, ply):
+        # Mate scores are stored relative to this node so they stay valid at other plies
+        if score > MATE_SCORE - 1000:
+            score += ply
+        elif score < 1000 - MATE_SCORE:
+            score -= ply
+        if len(self.tt) >= TT_MAX_ENTRIES:
+            self.tt.clear()
+        self.tt[h] = (depth, score, bound, move)
+    
+    def probe_tt(self, h, ply):
+        entry = self.tt.get(h)
+        if not entry:
+            return None
+        depth, score, bound, move = entry
+        if score > MATE_SCORE - 1000:
+            score -= ply
+        elif score < 1000 - MATE_SCORE:
+            score += ply
+        return depth, score, bound, move
+    
+    def has_major_pieces(self, color):
+        # Without a chariot, horse or cannon, passing can be better than any move
+        return any(
+            p.color == color and p.piece_type in ('chariot', 'horse', 'cannon')
+            for p in self.pieces
+        )
+    
+    def negamax(self, depth, alpha, beta, ply, allow_null=True):
+        # Score from the side to move's point of view
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and self.search_expired():
+            self.search_aborted = True
+        if self.search_aborted:
+            return 0
+        
+        h = self.position_hash()
+        if self.position_counts.get(h):
+            return 0  # Repeating an earlier position scores as a draw
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply)
+        
+        in_check = self.is_in_check(self.current_turn)
+        if in_check and self.features['check_extensions'] and ply < 2 * self.root_depth:
+            depth += 1
+        
+        tt_move = None
+        entry = self.probe_tt(h, ply)
+        if entry:
+            tt_depth, tt_score, tt_bound, tt_move = entry
+            if tt_depth >= depth:
+                if tt_bound == TT_EXACT:
+                    return tt_score
+                if tt_bound == TT_LOWER and tt_score >= beta:
+                    return tt_score
+                if tt_bound == TT_UPPER and tt_score <= alpha:
+                    return tt_score
+        
+        if (allow_null and self.features['null_move'] and depth >= 3 and not in_check
+                and beta < MATE_SCORE - 1000 and self.has_major_pieces(self.current_turn)):
+            self.current_turn = 'b' if self.current_turn == 'r' else 'r'
+            score = -self.negamax(depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, ply + 1,
+                                  allow_null=False)
+            self.current_turn = 'b' if self.current_turn == 'r' else 'r'
+            if self.search_aborted:
+                return 0
+            if score >= beta:
+                return beta
+        
+        alpha_orig = alpha
+        best_score = -MATE_SCORE
+        best_move = None
+        moves = self.order_moves(self.generate_moves(self.current_turn), tt_move)
+        
+        # Mark this position as on the search path so cycles back to it score as draws
+        self.position_counts[h] = 1
+        reduce_late_moves = self.features['late_move_reductions'] and depth >= 3 and not in_check
+        for index, (piece, x, y, target_piece) in enumerate(moves):
+            if target_piece and target_piece.piece_type == 'general':
+                best_score = MATE_SCORE - ply
+                best_move = (piece.x, piece.y, x, y)
+                break
+            
+            orig_x, orig_y = self.make_move(piece, x, y, target_piece)
+            if reduce_late_moves and index >= LMR_MIN_MOVES and not target_piece:
+                # Reduced null-window search first; only a move that beats alpha gets a full search
+                score = -self.negamax(depth - 2, -alpha - 1, -alpha, ply + 1)
+                if score > alpha:
+                    score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
             else:
-                black_mobility += len(legal_moves)
-        
-        score += (red_mobility - black_mobility) * 0.1
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            self.unmake_move(piece, orig_x, orig_y, target_piece)
+            if self.search_aborted:
+                break
+            
+            if score > best_score:
+                best_score = score
+                best_move = (orig_x, orig_y, x, y)
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        del self.position_counts[h]
         
-        # Check status
-        if self.is_in_check('b'):
-            score += 50
-        if self.is_in_check('r'):
-            score -= 50
+        if self.search_aborted:
+            return 0
         
-        return score
+        if best_score <= alpha_orig:
+            bound = TT_UPPER
+        elif best_score >= beta:
+            bound = TT_LOWER
+        else:
+            bound = TT_EXACT
+        self.store_tt(h, depth, best_score, bound, best_move, ply)
+        return best_score
     
-    def ai_make_move(self):
-        if self.current_turn != self.player_color:
-            best_score = float('-inf') if self.current_turn == 'r' else float('inf')
-            best_move = None
+    def quiescence(self, alpha, beta, ply):
+        # Search captures only, so leaves are not evaluated in the middle of an exchange
+        self.nodes += 1
+        stand_pat = self.evaluate_board()
+        if self.current_turn == 'b':
+            stand_pat = -stand_pat
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        
+        captures = [move for move in self.generate_moves(self.current_turn) if move[3]]
+        for piece, x, y, target_piece in self.order_moves(captures, None):
+            if target_piece.piece_type == 'general':
+                return MATE_SCORE - ply
             
-            # Get all possible moves for AI
-            possible_moves = []
-            for piece in self.pieces:
-                if piece.color == self.current_turn:
-                    legal_moves = self.get_legal_moves(piece)
-                    for move in legal_moves:
-                        possible_moves.append((piece, move[0], move[1]))
+            orig_x, orig_y = self.make_move(piece, x, y, target_piece)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            self.unmake_move(piece, orig_x, orig_y, target_piece)
             
-            # If AI has no legal moves, switch turns back to player
-            if not possible_moves:
-                # Switch turns to player
-                self.current_turn = 'b' if self.current_turn == 'r' else 'r'
-                return True
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+    
+    def search(self, max_depth=AI_DEPTH, time_limit=AI_TIME_LIMIT, stop_event=None, features=None):
+        # Iterative deepening alpha-beta; returns (best move as (piece, x, y), score)
+        self.begin_search(time_limit, stop_event, features)
+        # (depth, score, move, nodes, seconds) for each completed iteration
+        self.iterations = []
+        start_time = time.perf_counter()
+        
+        root_moves = self.generate_root_moves()
+        if not root_moves:
+            return None, -MATE_SCORE
+        
+        # Randomize move order to add variety between equally scored moves
+        random.shuffle(root_moves)
+        
+        h = self.position_hash()
+        best_move = None
+        best_score = -MATE_SCORE
+        for depth in range(1, max_depth + 1):
+            self.root_depth = depth
+            entry = self.tt.get(h)
+            self.order_moves(root_moves, entry[3] if entry else best_move)
             
-            # Randomize move order to add variety
-            random.shuffle(possible_moves)
+            alpha, beta = -MATE_SCORE - 1, MATE_SCORE + 1
+            if (self.features['aspiration_windows'] and best_move
+                    and abs(best_score) < MATE_SCORE - 1000):
+                alpha, beta = best_score - ASPIRATION_WINDOW, best_score + ASPIRATION_WINDOW
+            score, move = self.search_root(root_moves, depth, alpha, beta)
+            if not self.search_aborted and (score <= alpha or score >= beta):
+                # The score fell outside the aspiration window: search again with a full window
+                score, move = self.search_root(root_moves, depth, -MATE_SCORE - 1, MATE_SCORE + 1)
             
-            for move in possible_moves:
-                piece, new_x, new_y = move
-                
-                # Save original position
-                orig_x, orig_y = piece.x, piece.y
-                
-                # Save target piece if any
-                target_piece = self.get_piece_at(new_x, new_y)
-                if target_piece:
-                    self.pieces.remove(target_piece)
-                
-                # Make the move
-                piece.x, piece.y = new_x, new_y
-                
-                # Switch turns temporarily
-                self.current_turn = 'b' if self.current_turn == 'r' else 'r'
-                
-                # Evaluate the board
-                score = self.evaluate_board()
-                
-                # Restore turns
-                self.current_turn = 'b' if self.current_turn == 'r' else 'r'
-                
-                # Restore original position
-                piece.x, piece.y = orig_x, orig_y
-                
-                # Restore target piece if any
-                if target_piece:
-                    self.pieces.append(target_piece)
-                
-                # Update best move
-                if self.current_turn == 'r':
-                    if score > best_score:
-                        best_score = score
-                        best_move = move
-                else:
-                    if score < best_score:
-                        best_score = score
-                        best_move = move
+            # Keep the last completed iteration, or a partial first one if time ran out
+            if move and (not self.search_aborted or best_move is None):
+                best_move, best_score = move, score
+                self.store_tt(h, depth, best_score, TT_EXACT, best_move, 0)
+            if self.search_aborted:
+                break
+            self.iterations.append((depth, best_score, best_move, self.nodes,
+                                    time.perf_counter() - start_time))
+            if best_score >= MATE_SCORE - max_depth:
+                break
+        
+        if best_move is None:
+            best_move = (root_moves[0][0].x, root_moves[0][0].y, root_moves[0][1], root_moves[0][2])
+        from_x, from_y, to_x, to_y = best_move
+        return (self.get_piece_at(from_x, from_y), to_x, to_y), best_score
+    
+    def begin_search(self, time_limit, stop_event, features):
+        self.nodes = 0
+        self.search_aborted = False
+        self.search_deadline = time.perf_counter() + time_limit if time_limit else None
+        self.stop_event = stop_event
+        self.features = SEARCH_FEATURES if features is None else features
+    
+    def generate_root_moves(self):
+        # Root moves are fully legal; deeper nodes rely on general capture
+        occupied = {(p.x, p.y): p for p in self.pieces}
+        own_pieces = [p for p in self.pieces if p.color == self.current_turn]
+        root_moves = []
+        for piece in own_pieces:
+            for x, y in self.get_legal_moves(piece):
+                root_moves.append((piece, x, y, occupied.get((x, y))))
+        return root_moves
+    
+    def analyse(self, lines=3, max_depth=AI_DEPTH, time_limit=None, stop_event=None, features=None):
+        # Multi-PV analysis: after each completed iteration, yields (depth, [(score, pv), ...])
+        # with the best `lines` moves first. Scores are from the side to move's point of view
+        # and each pv is a list of (from_x, from_y, to_x, to_y). All lines come from one pass
+        # over the root moves per iteration, see search_root_lines.
+        # The board must not be changed while the generator is suspended.
+        self.begin_search(time_limit, stop_event, features)
+        root_moves = self.order_moves(self.generate_root_moves(), None)
+        if not root_moves:
+            return
+        
+        previous = []
+        for depth in range(1, max_depth + 1):
+            self.root_depth = depth
+            # Start just below the last iteration's worst reported line, as an aspiration window
+            floor = -MATE_SCORE - 1
+            if (self.features['aspiration_windows'] and len(previous) == lines
+                    and abs(previous[-1]) < MATE_SCORE - 1000):
+                floor = previous[-1] - ASPIRATION_WINDOW
+            best = self.search_root_lines(root_moves, depth, lines, floor)
+            if not self.search_aborted and len(best) < min(lines, len(root_moves)):
+                # Fewer lines than asked for scored above the floor: search again without it
+                best = self.search_root_lines(root_moves, depth, lines, -MATE_SCORE - 1)
+            if self.search_aborted:
+                return
+            results = [(score, self.principal_variation(move, depth)) for score, move in best]
+            previous = [score for score, _ in best]
+            
+            # The next iteration searches this iteration's lines first, in order
+            ranked = [pv[0] for _, pv in results]
+            root_moves.sort(key=lambda m: ranked.index((m[0].x, m[0].y, m[1], m[2]))
+                            if (m[0].x, m[0].y, m[1], m[2]) in ranked else len(ranked))
+            yield depth, results
+    
+    def principal_variation(self, move, max_length):
+        # The given root move followed by best moves from the transposition table
+        pv = []
+        played = []
+        seen = set()
+        while move and len(pv) < max_length:
+            from_x, from_y, to_x, to_y = move
+            piece = self.get_piece_at(from_x, from_y)
+            if not piece or piece.color != self.current_turn:
+                break
+            if (to_x, to_y) not in self.get_legal_moves(piece, check_check=False):
+                break
+            target_piece = self.get_piece_at(to_x, to_y)
+            self.make_move(piece, to_x, to_y, target_piece)
+            played.append((piece, from_x, from_y, target_piece))
+            pv.append(move)
+            
+            h = self.position_hash()
+            if h in seen or (target_piece and target_piece.piece_type == 'general'):
+                break
+            seen.add(h)
+            entry = self.tt.get(h)
+            move = entry[3] if entry else None
+        
+        for piece, from_x, from_y, target_piece in reversed(played):
+            self.unmake_move(piece, from_x, from_y, target_piece)
+        return pv
+    
+    def search_root(self, root_moves, depth, alpha, beta):
+        best_score = -MATE_SCORE - 1
+        best_move = None
+        for piece, x, y, target_piece in root_moves:
+            orig_x, orig_y = self.make_move(piece, x, y, target_piece)
+            score = -self.negamax(depth - 1, -beta, -max(alpha, best_score), 1)
+            self.unmake_move(piece, orig_x, orig_y, target_piece)
+            if self.search_aborted:
+                break
+            if score > best_score:
+                best_score = score
+                best_move = (orig_x, orig_y, x, y)
+                if score >= beta:
+                    break
+        return best_score, best_move
+    
+    def search_root_lines(self, root_moves, depth, lines, floor):
+        # One pass over the root keeping the best `lines` moves as [(score, move), ...], best
+        # first. Each move only has to beat the current last line, so the rest fail low cheaply.
+        best = []
+        for piece, x, y, target_piece in root_moves:
+            alpha = best[-1][0] if len(best) == lines else floor
+            orig_x, orig_y = self.make_move(piece, x, y, target_piece)
+            score = -self.negamax(depth - 1, -MATE_SCORE - 1, -alpha, 1)
+            self.unmake_move(piece, orig_x, orig_y, target_piece)
+            if self.search_aborted:
+                break
+            if score > alpha:
+                best.append((score, (orig_x, orig_y, x, y)))
+                best.sort(key=lambda line: -line[0])
+                del best[lines:]
+        return best
+    
+    def expected_reply(self, piece, x, y):
+        # Best answer to (piece, x, y) according to the transposition table
+        target_piece = self.get_piece_at(x, y)
+        orig_x, orig_y = self.make_move(piece, x, y, target_piece)
+        entry = self.tt.get(self.position_hash())
+        self.unmake_move(piece, orig_x, orig_y, target_piece)
+        return entry[3] if entry else None
+    
+    def find_best_move(self, time_limit=AI_TIME_LIMIT, stop_event=None):
+        best_move, _ = self.search(time_limit=time_limit, stop_event=stop_event)
+        self.predicted_reply = self.expected_reply(*best_move) if best_move else None
+        return best_move
+    
+    def start_pondering(self):
+        # Search the position after the player's expected reply on a background thread
+        self.stop_pondering()
+        if not self.predicted_reply:
+            return
+        
+        from_x, from_y, to_x, to_y = self.predicted_reply
+        board = self.clone()
+        piece = board.get_piece_at(from_x, from_y)
+        if not piece or (to_x, to_y) not in board.get_legal_moves(piece):
+            return
+        board.move_piece(piece, to_x, to_y)
+        if board.is_game_over():
+            return
+        
+        board.ponder_result = None
+        stop_event = threading.Event()
+        
+        def run():
+            board.ponder_result = board.find_best_move(time_limit=None, stop_event=stop_event)
+        
+        thread = threading.Thread(target=run, daemon=True)
+        self.ponder = (board.position_hash(), board, thread, stop_event)
+        thread.start()
+    
+    def stop_pondering(self):
+        # Abandon the ponder search; its transposition table entries are kept
+        if self.ponder:
+            _, board, thread, stop_event = self.ponder
+            stop_event.set()
+            thread.join()
+            self.ponder = None
+    
+    def take_ponder_move(self):
+        # If the player made the predicted move, finish that search and use its result
+        if not self.ponder or self.ponder[0] != self.position_hash():
+            self.stop_pondering()
+            return None
+        
+        _, board, thread, stop_event = self.ponder
+        self.ponder = None
+        
+        # Give the ponder search at most a normal move's time from here on
+        timer = threading.Timer(AI_TIME_LIMIT, stop_event.set)
+        timer.start()
+        thread.join()
+        timer.cancel()
+        
+        if not board.ponder_result:
+            return None
+        piece, x, y = board.ponder_result
+        self.predicted_reply = board.predicted_reply
+        return self.get_piece_at(piece.x, piece.y), x, y
+    
+    def ai_make_move(self):
+        if self.current_turn != self.player_color:
+            best_move = self.take_ponder_move() or self.find_best_move()
             
             # Make the best move
             if best_move:
                 piece, new_x, new_y = best_move
                 self.move_piece(piece, new_x, new_y)
                 return True
-            else:
-                # If no best move found (shouldn't happen if possible_moves is not empty)
-                # Switch turns to player as fallback
-                self.current_turn = 'b' if self.current_turn == 'r' else 'r'
-                return True
+            # No legal moves: the AI has lost, which is_game_over reports
         
         return False
 
@@ -691,7 +1250,7 @@ class Game:
     
     def handle_event(self, event):
         if self.show_menu:
-            if event.type == MOUSEBUTTONDOWN:
+            if event.type == pygame.MOUSEBUTTONDOWN:
                 # Check if player clicked on red or black option
                 mouse_x, mouse_y = pygame.mouse.get_pos()
                 
@@ -707,8 +1266,10 @@ class Game:
                     self.show_menu = False
                     # AI makes first move if player is black
                     self.board.ai_make_move()
+                    if PONDER:
+                        self.board.start_pondering()
         else:
-            if event.type == MOUSEBUTTONDOWN and not self.game_over:
+            if event.type == pygame.MOUSEBUTTONDOWN and not self.game_over:
                 # Get board coordinates from mouse position
                 mouse_x, mouse_y = pygame.mouse.get_pos()
                 board_x = (mouse_x - BOARD_MARGIN_X) // CELL_SIZE
@@ -734,13 +1295,22 @@ class Game:
                         if result:
                             self.game_over = True
                             self.winner = result
+                        elif PONDER:
+                            self.board.start_pondering()
             
-            elif event.type == KEYDOWN:
-                if event.key == K_r:  # Reset game
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_r:  # Reset game
                     self.board.reset()
                     self.game_over = False
                     self.winner = None
                     self.show_menu = True
+                elif event.key == pygame.K_u:  # Take back the last move and the AI's reply
+                    plies = 2 if self.board.current_turn == self.board.player_color else 1
+                    first_player_ply = 0 if self.board.player_color == 'r' else 1
+                    if len(self.board.played_moves) // 2 - plies >= first_player_ply:
+                        self.board.take_back(plies)
+                        self.game_over = False
+                        self.winner = None
     
     def draw(self, surface):
         surface.fill(WHITE)
@@ -755,13 +1325,13 @@ class Game:
     
     def draw_menu(self, surface):
         # Draw title
-        font = pygame.font.SysFont('Arial', 48)
+        font = get_font(48)
         title = font.render('Chinese Chess (Xiangqi)', True, BLACK)
         title_rect = title.get_rect(center=(SCREEN_WIDTH // 2, 150))
         surface.blit(title, title_rect)
         
         # Draw instructions
-        font = pygame.font.SysFont('Arial', 24)
+        font = get_font(24)
         instr = font.render('Choose your side:', True, BLACK)
         instr_rect = instr.get_rect(center=(SCREEN_WIDTH // 2, 250))
         surface.blit(instr, instr_rect)
@@ -785,7 +1355,7 @@ class Game:
         surface.blit(overlay, (0, 0))
         
         # Draw game over message
-        font = pygame.font.SysFont('Arial', 48)
+        font = get_font(48)
         if self.winner == 'r':
             text = font.render('Red Wins!', True, RED)
         elif self.winner == 'b':
@@ -797,19 +1367,48 @@ class Game:
         surface.blit(text, text_rect)
         
         # Draw restart instruction
-        font = pygame.font.SysFont('Arial', 24)
-        restart = font.render('Press R to restart', True, BLACK)
+        font = get_font(24)
+        restart = font.render('Press R to restart or U to take back', True, BLACK)
         restart_rect = restart.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 50))
         surface.blit(restart, restart_rect)
 
+_fonts = {}
+
+def get_font(size, bold=False):
+    # Fonts are loaded once per size instead of on every frame
+    font = _fonts.get((size, bold))
+    if font is None:
+        if os.path.exists(FONT_FILE):
+            font = pygame.font.Font(FONT_FILE, size)
+            font.set_bold(bold)
+        else:
+            font = pygame.font.SysFont('Arial', size, bold=bold)
+        _fonts[(size, bold)] = font
+    return font
+
+def init_display():
+    global pygame
+    import pygame
+    
+    # Only the subsystems the game uses; pygame.init() would also start audio and joysticks
+    pygame.display.init()
+    pygame.font.init()
+    
+    # Set up the screen
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption('Chinese Chess (Xiangqi)')
+    return screen
+
 def main():
+    screen = init_display()
+
     clock = pygame.time.Clock()
     game = Game()
     
     running = True
     while running:
         for event in pygame.event.get():
-            if event.type == QUIT:
+            if event.type == pygame.QUIT:
                 running = False
             
             game.handle_event(event)
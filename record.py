@@ -0,0 +1,165 @@
+from main import Board, BOARD_WIDTH
+
+# Record log format. Everything after the file header is a sequence of two-byte units:
+#   (from-square, to-square)   a move, squares numbered y * BOARD_WIDTH + x (0-89)
+#   (GAME_START, player color)  starts a game, color code 0 = red, 1 = black
+#   (GAME_END, result)          ends a game, result code 0 = unfinished, 1 = red, 2 = black, 3 = draw
+# Marker bytes never occur in move units, so games can be appended to the log one after another.
+FILE_HEADER = b'XQR\x01'
+GAME_START = 0xFF
+GAME_END = 0xFE
+
+COLOR_CODES = {'r': 0, 'b': 1}
+RESULT_CODES = {None: 0, 'r': 1, 'b': 2, 'draw': 3}
+COLORS = {code: color for color, code in COLOR_CODES.items()}
+RESULTS = {code: result for result, code in RESULT_CODES.items()}
+
+# Positions cached while replaying, so seeking to move N replays fewer than this many moves
+KEYFRAME_INTERVAL = 16
+
+# Bytes read at a time when streaming a log
+READ_CHUNK_SIZE = 1 << 16
+
+
+class GameRecord:
+    __slots__ = ('player_color', 'result', 'moves', 'keyframes')
+
+    def __init__(self, player_color='r', moves=b'', result=None):
+        self.player_color = player_color
+        self.result = result
+        self.moves = bytearray(moves)
+        # Ply -> board state, filled in lazily by position_at
+        self.keyframes = {}
+
+    @classmethod
+    def from_board(cls, board, result=None):
+        return cls(board.player_color, board.played_moves, result)
+
+    def __len__(self):
+        return len(self.moves) // 2
+
+    def __iter__(self):
+        for ply in range(len(self)):
+            yield self.move_at(ply)
+
+    def move_at(self, ply):
+        # Returns (from_x, from_y, to_x, to_y)
+        from_square = self.moves[2 * ply]
+        to_square = self.moves[2 * ply + 1]
+        return (from_square % BOARD_WIDTH, from_square // BOARD_WIDTH,
+                to_square % BOARD_WIDTH, to_square // BOARD_WIDTH)
+
+    def to_bytes(self):
+        return (bytes((GAME_START, COLOR_CODES[self.player_color])) + bytes(self.moves)
+                + bytes((GAME_END, RESULT_CODES[self.result])))
+
+    def position_at(self, ply):
+        # New Board with the first `ply` moves played, started from the nearest keyframe
+        if not 0 <= ply <= len(self):
+            raise IndexError(f'ply {ply} out of range for a {len(self)}-ply game')
+
+        start = ply - ply % KEYFRAME_INTERVAL
+        while start and start not in self.keyframes:
+            start -= KEYFRAME_INTERVAL
+
+        board = Board()
+        board.player_color = self.player_color
+        if start:
+            board.set_state(self.keyframes[start])
+        board.played_moves = self.moves[:2 * start]
+
+        for n in range(start, ply):
+            self.play(board, n)
+            if (n + 1) % KEYFRAME_INTERVAL == 0:
+                self.keyframes[n + 1] = board.get_state()
+        return board
+
+    def replay(self):
+        # Yields (ply, board) after each move, reusing one Board for the whole game
+        board = self.position_at(0)
+        yield 0, board
+        for ply in range(len(self)):
+            self.play(board, ply)
+            yield ply + 1, board
+
+    def play(self, board, ply):
+        from_x, from_y, to_x, to_y = self.move_at(ply)
+        piece = board.get_piece_at(from_x, from_y)
+        if not piece or piece.color != board.current_turn:
+            raise ValueError(f'corrupt game record: no piece to move at ply {ply}')
+        board.move_piece(piece, to_x, to_y)
+
+
+class RecordWriter:
+    # Appends finished games to a record log, writing the file header for a new log
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_HEADER)
+
+    def append(self, record):
+        self.file.write(record.to_bytes())
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_games(path, chunk_size=READ_CHUNK_SIZE):
+    # Streams GameRecords from a log; memory stays bounded by one chunk plus one game
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f'{path} is not a game record log')
+
+        buffer = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+
+            pos = 0
+            while True:
+                end = buffer.find(GAME_END, pos)
+                if end < 0 or end + 1 >= len(buffer):
+                    break
+                yield parse_game(buffer, pos, end)
+                pos = end + 2
+            buffer = buffer[pos:]
+
+        if buffer:
+            raise ValueError(f'{path} ends in the middle of a game')
+
+
+def parse_game(buffer, start, end):
+    if buffer[start] != GAME_START or (end - start) % 2:
+        raise ValueError('corrupt game record')
+    try:
+        return GameRecord(COLORS[buffer[start + 1]], buffer[start + 2:end], RESULTS[buffer[end + 1]])
+    except KeyError:
+        raise ValueError('corrupt game record')
+
+
+def main():
+    import argparse
+    import collections
+
+    parser = argparse.ArgumentParser(description='Summarize the games in record logs')
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    games = 0
+    plies = 0
+    results = collections.Counter()
+    for path in args.paths:
+        for record in read_games(path):
+            games += 1
+            plies += len(record)
+            results[record.result] += 1
+
+    print(f'games: {games}  plies: {plies}  red wins: {results["r"]}  black wins: {results["b"]}  '
+          f'draws: {results["draw"]}  unfinished: {results[None]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from main import BOARD_HEIGHT, BOARD_WIDTH, Board
+from record import GameRecord, RecordWriter
+
+# Protocol: one JSON object per line in each direction. Requests:
+#   {"op": "new", "color": "r"|"b"}                      -> {"ok", "game", "reply", "turn", "result"}
+#   {"op": "move", "game": id, "from": [x, y], "to": [x, y]} -> {"ok", "reply", "turn", "result"}
+#   {"op": "state", "game": id}                          -> {"ok", "pieces", "turn", "result"}
+#   {"op": "close", "game": id}                          -> {"ok"}
+# "reply" is the AI's answer as [[from_x, from_y], [to_x, to_y]] or null, and "result" is the
+# winner ("r" or "b"), "draw" or null while the game goes on. Errors come back as
+# {"ok": false, "error": "..."}, and an "id" field in a request is echoed in its response.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Longest request line accepted; keeps each connection's read buffer small
+MAX_LINE = 1024
+
+
+def raise_fd_limit():
+    # Thousands of local connections need more file descriptors than the usual soft limit
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# Transposition table kept by each worker process across the searches it runs
+_worker_tt = {}
+
+# Stop flags shared with the server, one per ponder that can be in flight
+_stop_flags = None
+
+
+def init_worker(stop_flags):
+    global _stop_flags
+    _stop_flags = stop_flags
+
+
+class StopFlag:
+    # Stands in for a threading.Event in Board.search: a byte of shared memory the server sets,
+    # so checking it in the worker is a memory read rather than a message to another process
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def is_set(self):
+        return _stop_flags[self.index] != 0
+
+
+def ai_reply(board, stop_flag=None):
+    # Runs in a worker process on an unpickled copy of the board. stop_flag is the index of
+    # this search's stop flag, for ponders
+    board.tt = _worker_tt
+    stop_event = StopFlag(stop_flag) if stop_flag is not None else None
+    move = board.find_best_move(stop_event=stop_event)
+    if move is None:
+        return None
+    piece, new_x, new_y = move
+    return [piece.x, piece.y], [new_x, new_y], board.predicted_reply
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_square(request, key):
+    # Plain ints on the board only; JSON floats and booleans would compare equal to ints
+    try:
+        x, y = request[key]
+    except (KeyError, TypeError, ValueError):
+        raise ProtocolError(f'move needs "{key}" as [x, y]')
+    if type(x) is not int or type(y) is not int:
+        raise ProtocolError(f'"{key}" must be integer coordinates')
+    if not (0 <= x < BOARD_WIDTH and 0 <= y < BOARD_HEIGHT):
+        raise ProtocolError(f'"{key}" is off the board')
+    return x, y
+
+
+class GameServer:
+    def __init__(self, workers=None, max_pending=None, ponder=False, record_path=None):
+        workers = workers or os.cpu_count() or 1
+        self.games = {}
+        # Games are appended to the record log when they are closed
+        self.recorder = RecordWriter(record_path) if record_path else None
+        # Game id -> (position hash after the expected player move, pool future of the AI reply
+        # to it, index of the flag that stops that search)
+        self.ponders = {}
+        self.ponder = ponder
+        # Cancelling a running pool job cannot stop it, so each ponder gets a flag its worker
+        # checks. Ponders only start on idle workers, so there are never more than `workers`.
+        self.stop_flags = multiprocessing.RawArray('b', workers)
+        self.free_flags = list(range(workers))
+        self.game_ids = itertools.count(1)
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                        initargs=(self.stop_flags,))
+        # Searches submitted to the pool and not yet finished, ponders included
+        self.jobs = 0
+        # Bound the number of searches queued on the pool; further requests wait here
+        self.ai_slots = asyncio.Semaphore(max_pending or workers * 4)
+
+    def close(self):
+        for game_id in list(self.ponders):
+            self.cancel_ponder(game_id)
+        self.pool.shutdown(cancel_futures=True)
+        if self.recorder:
+            self.recorder.close()
+
+    async def handle_connection(self, reader, writer):
+        # Games created on this connection are dropped when it closes
+        owned = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break  # Line too long or connection reset
+                if not line:
+                    break
+
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ProtocolError('request must be a JSON object')
+                    response = await self.dispatch(request, owned)
+                except (ValueError, TypeError, ProtocolError) as e:
+                    response = {'ok': False, 'error': str(e)}
+
+                if isinstance(request, dict) and 'id' in request:
+                    response['id'] = request['id']
+                writer.write(json.dumps(response, separators=(',', ':')).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in owned:
+                self.end_game(game_id)
+            writer.close()
+
+    async def dispatch(self, request, owned):
+        op = request.get('op')
+        if op == 'new':
+            return await self.new_game(request, owned)
+        if op == 'move':
+            return await self.player_move(request, owned)
+        if op == 'state':
+            board = self.get_game(request, owned)
+            pieces = [[p.piece_type, p.color, p.x, p.y] for p in board.pieces]
+            return {'ok': True, 'pieces': pieces, 'turn': board.current_turn,
+                    'result': board.is_game_over()}
+        if op == 'close':
+            game_id = request.get('game')
+            self.get_game(request, owned)
+            owned.discard(game_id)
+            self.end_game(game_id)
+            return {'ok': True}
+        raise ProtocolError(f'unknown op: {op!r}')
+
+    def end_game(self, game_id):
+        board = self.games.pop(game_id)
+        self.cancel_ponder(game_id)
+        if self.recorder and board.played_moves:
+            self.recorder.append(GameRecord.from_board(board, board.is_game_over()))
+
+    def get_game(self, request, owned):
+        game_id = request.get('game')
+        if game_id not in owned:
+            raise ProtocolError(f'unknown game: {game_id!r}')
+        return self.games[game_id]
+
+    async def new_game(self, request, owned):
+        color = request.get('color', 'r')
+        if color not in ('r', 'b'):
+            raise ProtocolError(f'invalid color: {color!r}')
+
+        board = Board()
+        board.player_color = color
+        game_id = next(self.game_ids)
+        self.games[game_id] = board
+        owned.add(game_id)
+
+        # AI makes first move if player is black
+        reply = None
+        if color == 'b':
+            reply = await self.ai_move(game_id, board)
+        return {'ok': True, 'game': game_id, 'reply': reply, 'turn': board.current_turn,
+                'result': board.is_game_over()}
+
+    async def player_move(self, request, owned):
+        board = self.get_game(request, owned)
+        if board.is_game_over():
+            raise ProtocolError('game is over')
+        if board.current_turn != board.player_color:
+            raise ProtocolError('not your turn')
+
+        from_x, from_y = parse_square(request, 'from')
+        to_x, to_y = parse_square(request, 'to')
+
+        piece = board.get_piece_at(from_x, from_y)
+        if not piece or piece.color != board.player_color:
+            raise ProtocolError('no piece of yours at "from"')
+        if (to_x, to_y) not in board.get_legal_moves(piece):
+            raise ProtocolError('illegal move')
+        board.move_piece(piece, to_x, to_y)
+
+        reply = None
+        if not board.is_game_over():
+            reply = await self.ai_move(request['game'], board)
+        return {'ok': True, 'reply': reply, 'turn': board.current_turn,
+                'result': board.is_game_over()}
+
+    async def ai_move(self, game_id, board):
+        ponder = self.ponders.pop(game_id, None)
+        if ponder and ponder[0] == board.position_hash():
+            # The player made the expected move, so the reply is already being searched
+            reply = await asyncio.wrap_future(ponder[1])
+        else:
+            if ponder:
+                self.stop_ponder(ponder)
+            if self.jobs >= self.workers:
+                # No worker is free: other games' speculative searches give way to this real one
+                for other_game in list(self.ponders):
+                    self.cancel_ponder(other_game)
+            loop = asyncio.get_running_loop()
+            async with self.ai_slots:
+                self.jobs += 1
+                try:
+                    reply = await loop.run_in_executor(self.pool, ai_reply, board.clone())
+                finally:
+                    self.jobs -= 1
+
+        if reply is None:
+            # No legal moves: the AI has lost, which is_game_over reports
+            return None
+
+        (from_x, from_y), (to_x, to_y), predicted_reply = reply
+        board.move_piece(board.get_piece_at(from_x, from_y), to_x, to_y)
+        if self.ponder and not board.is_game_over():
+            await self.start_pondering(game_id, board, predicted_reply)
+        return [[from_x, from_y], [to_x, to_y]]
+
+    async def start_pondering(self, game_id, board, predicted_reply):
+        # Search the reply to the player's expected move, but only while a worker is idle, so
+        # the ponder never queues in front of another game's real search
+        if not predicted_reply or self.jobs >= self.workers or self.ai_slots.locked():
+            return
+
+        from_x, from_y, to_x, to_y = predicted_reply
+        ponder_board = board.clone()
+        piece = ponder_board.get_piece_at(from_x, from_y)
+        if not piece or (to_x, to_y) not in ponder_board.get_legal_moves(piece):
+            return
+        ponder_board.move_piece(piece, to_x, to_y)
+        if ponder_board.is_game_over():
+            return
+
+        await self.ai_slots.acquire()
+        self.jobs += 1
+        loop = asyncio.get_running_loop()
+        stop_flag = self.free_flags.pop()
+        self.stop_flags[stop_flag] = 0
+        # The slot and flag are held until the job itself finishes, not just until nobody wants
+        # its result
+        future = self.pool.submit(ai_reply, ponder_board, stop_flag)
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self.ponder_done, f, stop_flag))
+        self.ponders[game_id] = (ponder_board.position_hash(), future, stop_flag)
+
+    def ponder_done(self, future, stop_flag):
+        self.free_flags.append(stop_flag)
+        self.jobs -= 1
+        self.ai_slots.release()
+        if not future.cancelled():
+            future.exception()  # Mark a failure as seen when nobody awaits a missed ponder
+
+    def stop_ponder(self, ponder):
+        # Drop a queued search, or make a running one return at its next node check
+        _, future, stop_flag = ponder
+        future.cancel()
+        self.stop_flags[stop_flag] = 1
+
+    def cancel_ponder(self, game_id):
+        ponder = self.ponders.pop(game_id, None)
+        if ponder:
+            self.stop_ponder(ponder)
+
+
+async def serve(args):
+    raise_fd_limit()
+    game_server = GameServer(args.workers, args.max_pending, args.ponder, args.record)
+    if args.unix:
+        server = await asyncio.start_unix_server(
+            game_server.handle_connection, args.unix, limit=MAX_LINE)
+    else:
+        server = await asyncio.start_server(
+            game_server.handle_connection, args.host, args.port, limit=MAX_LINE)
+
+    address = args.unix or f'{args.host}:{args.port}'
+    print(f'Serving Xiangqi games on {address}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve many Xiangqi games over a line-delimited JSON protocol')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='listen on a Unix socket path instead of TCP')
+    parser.add_argument('--workers', type=int, help='AI worker processes (default: CPU count)')
+    parser.add_argument('--max-pending', type=int, help='AI searches queued on the pool at once')
+    parser.add_argument('--ponder', action='store_true',
+                        help="use idle workers to search the reply to each player's expected move")
+    parser.add_argument('--record', help='append every game to this record log when it ends')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()